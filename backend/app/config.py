@@ -38,6 +38,11 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = "uploads"
     MAX_UPLOAD_SIZE: int = 10485760  # 10MB
     
+    # Background jobs (APScheduler)
+    SCHEDULER_ENABLED: bool = True
+    STOCK_SNAPSHOT_HOUR: int = 0  # Daily stock ledger snapshot (00:05)
+    STOCK_SNAPSHOT_MINUTE: int = 5
+    
     @field_validator('ALLOWED_ORIGINS', mode='before')
     @classmethod
     def parse_allowed_origins(cls, v):
@@ -3,6 +3,7 @@ Database Configuration and Session Management
 Supports PostgreSQL (production) and SQLite (testing)
 """
 from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
@@ -19,12 +20,22 @@ def get_engine():
     
     if settings.is_sqlite:
         # SQLite specific settings
-        engine = create_engine(
-            database_url,
-            connect_args={"check_same_thread": False},
-            poolclass=StaticPool,
-            echo=settings.DEBUG
-        )
+        in_memory = database_url in ("sqlite://", "sqlite:///:memory:")
+        if in_memory:
+            # A single shared connection, otherwise every connection sees its own database
+            engine = create_engine(
+                database_url,
+                connect_args={"check_same_thread": False},
+                poolclass=StaticPool,
+                echo=settings.DEBUG
+            )
+        else:
+            # One connection per session; writers wait up to 30s for the lock
+            engine = create_engine(
+                database_url,
+                connect_args={"check_same_thread": False, "timeout": 30},
+                echo=settings.DEBUG
+            )
         
         # Enable foreign key support for SQLite
         @event.listens_for(engine, "connect")
@@ -32,6 +43,17 @@ def get_engine():
             cursor = dbapi_connection.cursor()
             cursor.execute("PRAGMA foreign_keys=ON")
             cursor.close()
+            if not in_memory:
+                # Let SQLAlchemy emit BEGIN itself (see begin_immediate)
+                dbapi_connection.isolation_level = None
+        
+        if not in_memory:
+            # SQLite has no SELECT ... FOR UPDATE. Taking the write lock when the
+            # transaction starts serializes read-check-write stock updates the
+            # same way row locks do on PostgreSQL.
+            @event.listens_for(engine, "begin")
+            def begin_immediate(connection):
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
     else:
         # PostgreSQL settings
         engine = create_engine(
@@ -67,9 +89,33 @@ def get_db():
         db.close()
 
 
+def dialect_insert(dialect_name: str):
+    """
+    Return the dialect specific insert() construct.
+    Both SQLite and PostgreSQL versions support on_conflict_do_update / do_nothing.
+    """
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
 def create_tables():
-    """Create all tables in the database"""
+    """
+    Create all tables in the database.
+    Indexes added to models after a table already exists are created as well,
+    create_all() alone skips existing tables.
+    """
     Base.metadata.create_all(bind=engine)
+    
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except DBAPIError as e:
+                # e.g. duplicate rows violating a new unique index
+                print(f"⚠️  Index {index.name} oluşturulamadı: {e.orig}")
 
 
 def drop_tables():
@@ -11,6 +11,7 @@ from app.config import settings as app_settings
 from app.database import engine, Base
 from app.routers import auth, users, customers, opportunities, projects, products, warehouses, stock, invoices, expenses, service_forms, delivery_notes, reports
 from app.routers import settings as settings_router
+from app.services.scheduler import start_scheduler, shutdown_scheduler
 
 
 @asynccontextmanager
@@ -22,11 +23,15 @@ async def lifespan(app: FastAPI):
     # Create upload directory if not exists
     os.makedirs(app_settings.UPLOAD_DIR, exist_ok=True)
     
+    # Start background jobs (stock ledger snapshots)
+    start_scheduler()
+    
     # TODO: Start TCMB currency scheduler
     
     yield
     
     # Shutdown
+    shutdown_scheduler()
     print("👋 Otomasyon CRM kapatılıyor...")
 
 
@@ -62,6 +67,7 @@ class DynamicCORSMiddleware(BaseHTTPMiddleware):
         if origin:
             response.headers["Access-Control-Allow-Origin"] = origin
             response.headers["Access-Control-Allow-Credentials"] = "true"
+            response.headers["Access-Control-Expose-Headers"] = "X-Next-Cursor"
         
         return response
 
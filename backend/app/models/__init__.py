@@ -4,7 +4,7 @@ Models Package - Import all models for easy access
 from app.models.user import User, Role
 from app.models.project import Customer, Opportunity, Quote, Project, OpportunityStatus, ProjectStatus, Currency
 from app.models.product import Product, ProductCategory, BOMItem
-from app.models.warehouse import Warehouse, WarehouseStock, StockMovement, StockReservation, WarehouseType, MovementType, ReservationStatus
+from app.models.warehouse import Warehouse, WarehouseStock, ProductStockTotal, StockMovement, StockReservation, StockSnapshot, StockSnapshotLine, WarehouseType, MovementType, ReservationStatus
 from app.models.invoice import Invoice, InvoiceItem
 from app.models.expense import Expense, PersonnelAccount, AccountTransaction
 from app.models.service_form import ServiceForm, ServiceFormItem, DeliveryNote, DeliveryNoteItem
@@ -31,8 +31,11 @@ __all__ = [
     "BOMItem",
     "Warehouse",
     "WarehouseStock",
+    "ProductStockTotal",
     "StockMovement",
     "StockReservation",
+    "StockSnapshot",
+    "StockSnapshotLine",
     "WarehouseType",
     "MovementType",
     "ReservationStatus",
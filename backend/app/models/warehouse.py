@@ -1,12 +1,13 @@
 """
 Warehouse and Stock Models
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric, Text, Enum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric, Text, Enum, Index, event, inspect
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from decimal import Decimal
 import enum
 
-from app.database import Base
+from app.database import Base, dialect_insert
 
 
 class WarehouseType(enum.Enum):
@@ -95,6 +96,11 @@ class WarehouseStock(Base):
     warehouse = relationship("Warehouse", back_populates="warehouse_stocks")
     product = relationship("Product", back_populates="warehouse_stocks")
     
+    # One row per warehouse-product, get_or_create_warehouse_stock upserts on it
+    __table_args__ = (
+        Index("uq_warehouse_stocks_warehouse_product", "warehouse_id", "product_id", unique=True),
+    )
+    
     def __repr__(self):
         return f"<WarehouseStock {self.warehouse_id}-{self.product_id}: {self.quantity}>"
     
@@ -104,6 +110,87 @@ class WarehouseStock(Base):
         return self.quantity - (self.reserved_quantity or 0)
 
 
+class ProductStockTotal(Base):
+    """
+    Per-product stock totals across all warehouses.
+    Maintained in the same transaction as every WarehouseStock change,
+    so listings and low-stock checks don't need to SUM warehouse_stocks.
+    """
+    __tablename__ = "product_stock_totals"
+    
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    
+    total_quantity = Column(Numeric(15, 3), nullable=False, default=0)
+    total_reserved = Column(Numeric(15, 3), nullable=False, default=0)
+    available = Column(Numeric(15, 3), nullable=False, default=0, index=True)  # total_quantity - total_reserved
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<ProductStockTotal {self.product_id}: {self.total_quantity}>"
+
+
+def apply_product_stock_total_deltas(connection, deltas) -> None:
+    """
+    Add quantity/reserved deltas to product_stock_totals (upsert).
+    deltas: {product_id: (quantity_delta, reserved_delta)}
+    """
+    rows = [
+        {
+            "product_id": product_id,
+            "total_quantity": quantity_delta,
+            "total_reserved": reserved_delta,
+            "available": quantity_delta - reserved_delta
+        }
+        for product_id, (quantity_delta, reserved_delta) in deltas.items()
+    ]
+    if not rows:
+        return
+    
+    table = ProductStockTotal.__table__
+    stmt = dialect_insert(connection.dialect.name)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.product_id],
+        set_={
+            "total_quantity": table.c.total_quantity + stmt.excluded.total_quantity,
+            "total_reserved": table.c.total_reserved + stmt.excluded.total_reserved,
+            "available": table.c.available + stmt.excluded.available,
+            "updated_at": func.now()
+        }
+    )
+    connection.execute(stmt, rows)
+
+
+def _attribute_delta(target, name: str) -> Decimal:
+    """Difference between the pending and the persisted value of a numeric attribute"""
+    history = inspect(target).attrs[name].history
+    new = history.added[0] if history.added else getattr(target, name)
+    old = history.deleted[0] if history.deleted else new
+    return Decimal(new or 0) - Decimal(old or 0)
+
+
+@event.listens_for(WarehouseStock, "after_insert")
+def _stock_total_after_insert(mapper, connection, target):
+    apply_product_stock_total_deltas(connection, {
+        target.product_id: (Decimal(target.quantity or 0), Decimal(target.reserved_quantity or 0))
+    })
+
+
+@event.listens_for(WarehouseStock, "after_update")
+def _stock_total_after_update(mapper, connection, target):
+    quantity_delta = _attribute_delta(target, "quantity")
+    reserved_delta = _attribute_delta(target, "reserved_quantity")
+    if quantity_delta or reserved_delta:
+        apply_product_stock_total_deltas(connection, {target.product_id: (quantity_delta, reserved_delta)})
+
+
+@event.listens_for(WarehouseStock, "after_delete")
+def _stock_total_after_delete(mapper, connection, target):
+    apply_product_stock_total_deltas(connection, {
+        target.product_id: (-Decimal(target.quantity or 0), -Decimal(target.reserved_quantity or 0))
+    })
+
+
 class StockMovement(Base):
     """Stock movement/transaction log"""
     __tablename__ = "stock_movements"
@@ -137,6 +224,16 @@ class StockMovement(Base):
     created_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
+    # Keyset pagination over (created_at, id), alone and behind each history filter
+    __table_args__ = (
+        Index("ix_stock_movements_created_at_id", "created_at", "id"),
+        Index("ix_stock_movements_product_created", "product_id", "created_at", "id"),
+        Index("ix_stock_movements_project_created", "project_id", "created_at", "id"),
+        Index("ix_stock_movements_from_warehouse_created", "from_warehouse_id", "created_at", "id"),
+        Index("ix_stock_movements_to_warehouse_created", "to_warehouse_id", "created_at", "id"),
+        Index("ix_stock_movements_type_created", "movement_type", "created_at", "id"),
+    )
+    
     # Relationships
     project = relationship("Project", back_populates="stock_movements")
     product = relationship("Product", back_populates="stock_movements")
@@ -181,3 +278,42 @@ class StockReservation(Base):
     
     def __repr__(self):
         return f"<StockReservation {self.project_id}: {self.product_id} x{self.quantity}>"
+
+
+class StockSnapshot(Base):
+    """
+    Point-in-time stock ledger checkpoint.
+    Balances as of snapshot_at, so "as of" queries only replay
+    the movements written after it.
+    """
+    __tablename__ = "stock_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    
+    snapshot_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    line_count = Column(Integer, default=0)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    # Relationships
+    lines = relationship("StockSnapshotLine", back_populates="snapshot", cascade="all, delete-orphan")
+    
+    def __repr__(self):
+        return f"<StockSnapshot {self.snapshot_at}: {self.line_count} lines>"
+
+
+class StockSnapshotLine(Base):
+    """Per warehouse-product balance of a stock snapshot (non-zero balances only)"""
+    __tablename__ = "stock_snapshot_lines"
+    
+    snapshot_id = Column(Integer, ForeignKey("stock_snapshots.id", ondelete="CASCADE"), primary_key=True)
+    warehouse_id = Column(Integer, ForeignKey("warehouses.id"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    
+    quantity = Column(Numeric(15, 3), nullable=False)
+    
+    # Relationships
+    snapshot = relationship("StockSnapshot", back_populates="lines")
+    
+    def __repr__(self):
+        return f"<StockSnapshotLine {self.warehouse_id}-{self.product_id}: {self.quantity}>"
@@ -19,6 +19,10 @@ from app.schemas import (
     DeliveryNoteItemCreate, DeliveryNoteItemResponse
 )
 from app.routers.auth import get_current_user
+from app.services.stock_service import (
+    get_or_create_warehouse_stock, load_warehouse_stocks, change_warehouse_stock,
+    get_available_quantity, GUARD_AVAILABLE
+)
 
 router = APIRouter()
 
@@ -42,26 +46,6 @@ def generate_note_number(db: Session) -> str:
     return f"DN-{year}-{new_num:04d}"
 
 
-def get_or_create_warehouse_stock(db: Session, warehouse_id: int, product_id: int) -> WarehouseStock:
-    """Get or create warehouse stock record"""
-    stock = db.query(WarehouseStock).filter(
-        WarehouseStock.warehouse_id == warehouse_id,
-        WarehouseStock.product_id == product_id
-    ).first()
-    
-    if not stock:
-        stock = WarehouseStock(
-            warehouse_id=warehouse_id,
-            product_id=product_id,
-            quantity=Decimal("0"),
-            reserved_quantity=Decimal("0")
-        )
-        db.add(stock)
-        db.flush()
-    
-    return stock
-
-
 @router.get("/", response_model=List[DeliveryNoteResponse])
 async def get_delivery_notes(
     project_id: Optional[int] = None,
@@ -325,7 +309,8 @@ async def ship_delivery_note(
     current_user = Depends(get_current_user)
 ):
     """Ship delivery note - deduct from source warehouse"""
-    note = db.query(DeliveryNote).filter(DeliveryNote.id == note_id).first()
+    # Lock the note so it cannot be shipped twice concurrently
+    note = db.query(DeliveryNote).filter(DeliveryNote.id == note_id).with_for_update().first()
     if not note:
         raise HTTPException(status_code=404, detail="İrsaliye bulunamadı")
     
@@ -334,22 +319,21 @@ async def ship_delivery_note(
     
     items = db.query(DeliveryNoteItem).filter(DeliveryNoteItem.delivery_note_id == note_id).all()
     
-    # Check and deduct stock from source warehouse
+    # Lock the source stock rows, then deduct - the check is part of each UPDATE
+    load_warehouse_stocks(db, [(note.from_warehouse_id, item.product_id) for item in items], for_update=True)
+    
     for item in items:
-        stock = db.query(WarehouseStock).filter(
-            WarehouseStock.warehouse_id == note.from_warehouse_id,
-            WarehouseStock.product_id == item.product_id
-        ).first()
-        
-        available = (stock.quantity - (stock.reserved_quantity or Decimal("0"))) if stock else Decimal("0")
-        if available < item.quantity:
+        if not change_warehouse_stock(
+            db, note.from_warehouse_id, item.product_id,
+            quantity_delta=-item.quantity, guard=GUARD_AVAILABLE
+        ):
+            available = get_available_quantity(db, note.from_warehouse_id, item.product_id)
             product = db.query(Product).filter(Product.id == item.product_id).first()
+            db.rollback()
             raise HTTPException(
                 status_code=400,
                 detail=f"Yetersiz stok: {product.name if product else 'Bilinmeyen'}. Mevcut: {available}"
             )
-        
-        stock.quantity -= item.quantity
     
     note.status = "IN_TRANSIT"
     note.shipped_at = datetime.utcnow()
@@ -371,7 +355,8 @@ async def deliver_delivery_note(
     current_user = Depends(get_current_user)
 ):
     """Deliver delivery note - add to destination warehouse"""
-    note = db.query(DeliveryNote).filter(DeliveryNote.id == note_id).first()
+    # Lock the note so it cannot be delivered twice concurrently
+    note = db.query(DeliveryNote).filter(DeliveryNote.id == note_id).with_for_update().first()
     if not note:
         raise HTTPException(status_code=404, detail="İrsaliye bulunamadı")
     
@@ -382,8 +367,8 @@ async def deliver_delivery_note(
     
     # Add stock to destination warehouse and create movements
     for item in items:
-        stock = get_or_create_warehouse_stock(db, note.to_warehouse_id, item.product_id)
-        stock.quantity += item.quantity
+        get_or_create_warehouse_stock(db, note.to_warehouse_id, item.product_id)
+        change_warehouse_stock(db, note.to_warehouse_id, item.product_id, quantity_delta=item.quantity)
         
         # Create movement record
         product = db.query(Product).filter(Product.id == item.product_id).first()
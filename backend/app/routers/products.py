@@ -9,17 +9,27 @@ from typing import List, Optional
 from decimal import Decimal
 
 from app.database import get_db
-from app.models import Product, ProductCategory, BOMItem, WarehouseStock
+from app.models import Product, ProductCategory, BOMItem, WarehouseStock, ProductStockTotal
 from app.schemas import (
     ProductCreate, ProductUpdate, ProductResponse,
     ProductCategoryCreate, ProductCategoryResponse,
     BOMItemCreate, BOMItemResponse
 )
 from app.routers.auth import get_current_user
+from app.services.stock_service import rebuild_product_stock_totals
 
 router = APIRouter()
 
 
+def get_product_stock_info(db: Session, product_id: int) -> dict:
+    """Read total and available stock of a product from product_stock_totals"""
+    totals = db.query(ProductStockTotal).filter(ProductStockTotal.product_id == product_id).first()
+    return {
+        "total_stock": totals.total_quantity if totals else Decimal("0"),
+        "available_stock": totals.available if totals else Decimal("0")
+    }
+
+
 # ===== CATEGORIES =====
 
 @router.get("/categories", response_model=List[ProductCategoryResponse])
@@ -87,7 +97,9 @@ async def get_products(
     Get all products with stock information.
     Returns physical stock and available stock (after reservations).
     """
-    query = db.query(Product)
+    query = db.query(Product, ProductStockTotal).outerjoin(
+        ProductStockTotal, ProductStockTotal.product_id == Product.id
+    )
     
     # Filters
     if search:
@@ -109,11 +121,11 @@ async def get_products(
     if is_bom is not None:
         query = query.filter(Product.is_bom == is_bom)
     
-    products = query.offset(skip).limit(limit).all()
+    rows = query.offset(skip).limit(limit).all()
     
     # Add stock information
     result = []
-    for product in products:
+    for product, totals in rows:
         product_dict = {
             "id": product.id,
             "sku": product.sku,
@@ -136,20 +148,10 @@ async def get_products(
             "is_active": product.is_active,
             "created_at": product.created_at,
             "updated_at": product.updated_at,
-            "total_stock": Decimal("0"),
-            "available_stock": Decimal("0")
+            "total_stock": totals.total_quantity if totals else Decimal("0"),
+            "available_stock": totals.available if totals else Decimal("0")
         }
         
-        # Calculate total stock from all warehouses
-        stock_info = db.query(
-            func.sum(WarehouseStock.quantity).label("total"),
-            func.sum(WarehouseStock.quantity - WarehouseStock.reserved_quantity).label("available")
-        ).filter(WarehouseStock.product_id == product.id).first()
-        
-        if stock_info:
-            product_dict["total_stock"] = stock_info.total or Decimal("0")
-            product_dict["available_stock"] = stock_info.available or Decimal("0")
-        
         result.append(product_dict)
     
     return result
@@ -192,16 +194,9 @@ async def get_product(product_id: int, db: Session = Depends(get_db)):
             detail="Ürün bulunamadı"
         )
     
-    # Calculate total stock
-    stock_info = db.query(
-        func.sum(WarehouseStock.quantity).label("total"),
-        func.sum(WarehouseStock.quantity - WarehouseStock.reserved_quantity).label("available")
-    ).filter(WarehouseStock.product_id == product.id).first()
-    
     return {
         **product.__dict__,
-        "total_stock": stock_info.total or Decimal("0") if stock_info else Decimal("0"),
-        "available_stock": stock_info.available or Decimal("0") if stock_info else Decimal("0")
+        **get_product_stock_info(db, product.id)
     }
 
 
@@ -236,16 +231,9 @@ async def update_product(
     db.commit()
     db.refresh(product)
     
-    # Calculate total stock
-    stock_info = db.query(
-        func.sum(WarehouseStock.quantity).label("total"),
-        func.sum(WarehouseStock.quantity - WarehouseStock.reserved_quantity).label("available")
-    ).filter(WarehouseStock.product_id == product.id).first()
-    
     return {
         **product.__dict__,
-        "total_stock": stock_info.total or Decimal("0") if stock_info else Decimal("0"),
-        "available_stock": stock_info.available or Decimal("0") if stock_info else Decimal("0")
+        **get_product_stock_info(db, product.id)
     }
 
 
@@ -265,9 +253,7 @@ async def delete_product(
         )
     
     # Check if product has stock
-    total_stock = db.query(func.sum(WarehouseStock.quantity)).filter(
-        WarehouseStock.product_id == product_id
-    ).scalar()
+    total_stock = get_product_stock_info(db, product_id)["total_stock"]
     
     if total_stock and total_stock > 0:
         if not force:
@@ -277,6 +263,7 @@ async def delete_product(
             )
         # Force delete - clear stock records
         db.query(WarehouseStock).filter(WarehouseStock.product_id == product_id).delete()
+        rebuild_product_stock_totals(db, [product_id])
     
     product.is_active = False
     db.commit()
@@ -425,16 +412,19 @@ async def check_bom_stock(product_id: int, db: Session = Depends(get_db)):
     
     bom_items = db.query(BOMItem).filter(BOMItem.parent_product_id == product_id).all()
     
+    # Available stock of all components in one read
+    child_ids = [item.child_product_id for item in bom_items]
+    available_by_product = dict(
+        db.query(ProductStockTotal.product_id, ProductStockTotal.available).filter(
+            ProductStockTotal.product_id.in_(child_ids)
+        ).all()
+    ) if child_ids else {}
+    
     missing_components = []
     can_produce = True
     
     for item in bom_items:
-        # Get available stock for component
-        stock_info = db.query(
-            func.sum(WarehouseStock.quantity - WarehouseStock.reserved_quantity).label("available")
-        ).filter(WarehouseStock.product_id == item.child_product_id).first()
-        
-        available = stock_info.available or Decimal("0") if stock_info else Decimal("0")
+        available = available_by_product.get(item.child_product_id) or Decimal("0")
         
         if available < item.quantity:
             can_produce = False
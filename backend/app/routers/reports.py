@@ -12,7 +12,7 @@ from decimal import Decimal
 from app.database import get_db
 from app.models import (
     Project, Invoice, Expense, WarehouseStock, Product, StockMovement,
-    Customer, Opportunity, StockReservation, ProjectStatus
+    Customer, Opportunity, StockReservation, ProjectStatus, ProductStockTotal
 )
 from app.schemas import (
     DashboardStats, StockStatusReport, ExpenseSummaryReport,
@@ -54,19 +54,13 @@ async def get_dashboard_stats(
     ).scalar() or 0
     
     # Low stock items
-    low_stock_items = 0
-    products_with_min = db.query(Product).filter(
+    low_stock_items = db.query(func.count(Product.id)).outerjoin(
+        ProductStockTotal, ProductStockTotal.product_id == Product.id
+    ).filter(
         Product.min_stock_level > 0,
-        Product.is_active == True
-    ).all()
-    
-    for product in products_with_min:
-        total_stock = db.query(func.sum(WarehouseStock.quantity)).filter(
-            WarehouseStock.product_id == product.id
-        ).scalar() or Decimal("0")
-        
-        if total_stock < product.min_stock_level:
-            low_stock_items += 1
+        Product.is_active == True,
+        func.coalesce(ProductStockTotal.total_quantity, 0) < Product.min_stock_level
+    ).scalar() or 0
     
     return DashboardStats(
         total_projects=total_projects,
@@ -172,25 +166,26 @@ async def get_stock_status(
     
     # Low stock alerts
     low_stock_alerts = []
-    products_with_min = db.query(Product).filter(
+    low_stock_rows = db.query(
+        Product,
+        func.coalesce(ProductStockTotal.total_quantity, 0).label("total_stock")
+    ).outerjoin(
+        ProductStockTotal, ProductStockTotal.product_id == Product.id
+    ).filter(
         Product.min_stock_level > 0,
-        Product.is_active == True
+        Product.is_active == True,
+        func.coalesce(ProductStockTotal.total_quantity, 0) < Product.min_stock_level
     ).all()
     
-    for product in products_with_min:
-        total_stock = db.query(func.sum(WarehouseStock.quantity)).filter(
-            WarehouseStock.product_id == product.id
-        ).scalar() or Decimal("0")
-        
-        if total_stock < product.min_stock_level:
-            low_stock_alerts.append({
-                "product_id": product.id,
-                "sku": product.sku,
-                "name": product.name,
-                "current_stock": float(total_stock),
-                "min_level": product.min_stock_level,
-                "shortage": product.min_stock_level - float(total_stock)
-            })
+    for product, total_stock in low_stock_rows:
+        low_stock_alerts.append({
+            "product_id": product.id,
+            "sku": product.sku,
+            "name": product.name,
+            "current_stock": float(total_stock),
+            "min_level": product.min_stock_level,
+            "shortage": product.min_stock_level - float(total_stock)
+        })
     
     # Reserved items
     reserved_items = []
@@ -19,6 +19,7 @@ from app.schemas import (
     ServiceFormItemCreate, ServiceFormItemResponse, ServiceFormComplete
 )
 from app.routers.auth import get_current_user
+from app.services.stock_service import load_warehouse_stocks, change_warehouse_stock, GUARD_QUANTITY
 
 router = APIRouter()
 
@@ -345,7 +346,8 @@ async def complete_service_form(
     - Materials marked as 'delivered_to_customer' leave inventory
     - Cannot complete if vehicle warehouse has insufficient stock
     """
-    form = db.query(ServiceForm).filter(ServiceForm.id == form_id).first()
+    # Lock the form so it cannot be completed twice concurrently
+    form = db.query(ServiceForm).filter(ServiceForm.id == form_id).with_for_update().first()
     if not form:
         raise HTTPException(status_code=404, detail="Servis formu bulunamadı")
     
@@ -354,32 +356,27 @@ async def complete_service_form(
     
     items = db.query(ServiceFormItem).filter(ServiceFormItem.service_form_id == form_id).all()
     
-    # Check stock availability in vehicle warehouse
     if form.vehicle_warehouse_id:
-        for item in items:
-            stock = db.query(WarehouseStock).filter(
-                WarehouseStock.warehouse_id == form.vehicle_warehouse_id,
-                WarehouseStock.product_id == item.product_id
-            ).first()
-            
-            available = stock.quantity if stock else Decimal("0")
-            if available < item.quantity:
-                product = db.query(Product).filter(Product.id == item.product_id).first()
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Yetersiz stok: {product.name if product else 'Bilinmeyen'}. Mevcut: {available}, Gerekli: {item.quantity}"
-                )
+        load_warehouse_stocks(db, [(form.vehicle_warehouse_id, item.product_id) for item in items], for_update=True)
     
     # Deduct stock and create movements
     for item in items:
-        if form.vehicle_warehouse_id:
-            stock = db.query(WarehouseStock).filter(
+        # The stock check is part of the UPDATE, a failure rolls back all items
+        if form.vehicle_warehouse_id and not change_warehouse_stock(
+            db, form.vehicle_warehouse_id, item.product_id,
+            quantity_delta=-item.quantity, guard=GUARD_QUANTITY
+        ):
+            stock = db.query(WarehouseStock.quantity).filter(
                 WarehouseStock.warehouse_id == form.vehicle_warehouse_id,
                 WarehouseStock.product_id == item.product_id
             ).first()
-            
-            if stock:
-                stock.quantity -= item.quantity
+            available = stock.quantity if stock else Decimal("0")
+            product = db.query(Product).filter(Product.id == item.product_id).first()
+            db.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail=f"Yetersiz stok: {product.name if product else 'Bilinmeyen'}. Mevcut: {available}, Gerekli: {item.quantity}"
+            )
         
         # Create movement record
         product = db.query(Product).filter(Product.id == item.product_id).first()
@@ -2,47 +2,37 @@
 Stock Router
 Handles stock operations: transfers, reservations, movements
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Response, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+from sqlalchemy import func, or_, insert
 from typing import List, Optional
 from datetime import datetime
 from decimal import Decimal
+from collections import defaultdict
 
 from app.database import get_db
 from app.models import (
     Product, Warehouse, WarehouseStock, StockMovement, StockReservation,
-    Project, MovementType, ReservationStatus
+    Project, MovementType, ReservationStatus, ProductStockTotal, StockSnapshot
 )
 from app.schemas import (
     StockTransferRequest, StockReservationCreate, StockReservationResponse,
-    StockMovementCreate, StockMovementResponse
+    StockMovementCreate, StockMovementResponse,
+    StockMovementBulkCreate, StockMovementBulkResponse,
+    StockSnapshotCreate, StockSnapshotResponse
 )
 from app.routers.auth import get_current_user
+from app.services.stock_service import (
+    resolve_movement_delta, load_warehouse_stocks, apply_stock_deltas,
+    get_or_create_warehouse_stock, change_warehouse_stock, get_available_quantity,
+    GUARD_AVAILABLE, GUARD_QUANTITY
+)
+from app.services.stock_ledger import get_stock_as_of, write_stock_snapshot
+from app.utils.pagination import encode_cursor, keyset_before
 
 router = APIRouter()
 
 
-def get_or_create_warehouse_stock(db: Session, warehouse_id: int, product_id: int) -> WarehouseStock:
-    """Get or create warehouse stock record"""
-    stock = db.query(WarehouseStock).filter(
-        WarehouseStock.warehouse_id == warehouse_id,
-        WarehouseStock.product_id == product_id
-    ).first()
-    
-    if not stock:
-        stock = WarehouseStock(
-            warehouse_id=warehouse_id,
-            product_id=product_id,
-            quantity=Decimal("0"),
-            reserved_quantity=Decimal("0")
-        )
-        db.add(stock)
-        db.flush()
-    
-    return stock
-
-
 @router.get("/")
 async def get_stock_summary(
     db: Session = Depends(get_db)
@@ -57,17 +47,13 @@ async def get_stock_summary(
     # Total stock quantity
     total_stock = db.query(func.sum(WarehouseStock.quantity)).scalar() or 0
     
-    # Low stock count (products below min_stock_level)
-    low_stock_count = 0
-    products_with_stock = db.query(
-        WarehouseStock.product_id,
-        func.sum(WarehouseStock.quantity).label('total_qty')
-    ).group_by(WarehouseStock.product_id).all()
-    
-    for ps in products_with_stock:
-        product = db.query(Product).filter(Product.id == ps.product_id).first()
-        if product and product.min_stock_level and ps.total_qty < product.min_stock_level:
-            low_stock_count += 1
+    # Low stock count (products with stock records below min_stock_level)
+    low_stock_count = db.query(func.count(ProductStockTotal.product_id)).join(
+        Product, Product.id == ProductStockTotal.product_id
+    ).filter(
+        Product.min_stock_level > 0,
+        ProductStockTotal.total_quantity < Product.min_stock_level
+    ).scalar() or 0
     
     # Reserved stock
     reserved_stock = db.query(func.sum(WarehouseStock.reserved_quantity)).scalar() or 0
@@ -114,26 +100,31 @@ async def transfer_stock(
     if transfer.from_warehouse_id == transfer.to_warehouse_id:
         raise HTTPException(status_code=400, detail="Kaynak ve hedef depo aynı olamaz")
     
-    # Check source stock
-    from_stock = db.query(WarehouseStock).filter(
-        WarehouseStock.warehouse_id == transfer.from_warehouse_id,
-        WarehouseStock.product_id == transfer.product_id
-    ).first()
-    
-    available = (from_stock.quantity - (from_stock.reserved_quantity or Decimal("0"))) if from_stock else Decimal("0")
+    # Lock both stock rows (always in the same order) before changing them
+    get_or_create_warehouse_stock(db, transfer.to_warehouse_id, transfer.product_id)
+    load_warehouse_stocks(
+        db,
+        [
+            (transfer.from_warehouse_id, transfer.product_id),
+            (transfer.to_warehouse_id, transfer.product_id)
+        ],
+        for_update=True
+    )
     
-    if available < transfer.quantity:
+    # Deduct from source - the availability check is part of the UPDATE
+    if not change_warehouse_stock(
+        db, transfer.from_warehouse_id, transfer.product_id,
+        quantity_delta=-transfer.quantity, guard=GUARD_AVAILABLE
+    ):
+        available = get_available_quantity(db, transfer.from_warehouse_id, transfer.product_id)
+        db.rollback()
         raise HTTPException(
             status_code=400,
             detail=f"Yetersiz stok. Mevcut: {available}, Talep: {transfer.quantity}"
         )
     
-    # Deduct from source
-    from_stock.quantity -= transfer.quantity
-    
     # Add to destination
-    to_stock = get_or_create_warehouse_stock(db, transfer.to_warehouse_id, transfer.product_id)
-    to_stock.quantity += transfer.quantity
+    change_warehouse_stock(db, transfer.to_warehouse_id, transfer.product_id, quantity_delta=transfer.quantity)
     
     # Create movement record
     movement = StockMovement(
@@ -182,15 +173,13 @@ async def reserve_stock(
     if not product:
         raise HTTPException(status_code=404, detail="Ürün bulunamadı")
     
-    # Check available stock
-    stock = db.query(WarehouseStock).filter(
-        WarehouseStock.warehouse_id == reservation.warehouse_id,
-        WarehouseStock.product_id == reservation.product_id
-    ).first()
-    
-    available = (stock.quantity - (stock.reserved_quantity or Decimal("0"))) if stock else Decimal("0")
-    
-    if available < reservation.quantity:
+    # Update reserved quantity - the availability check is part of the UPDATE
+    if not change_warehouse_stock(
+        db, reservation.warehouse_id, reservation.product_id,
+        reserved_delta=reservation.quantity, guard=GUARD_AVAILABLE
+    ):
+        available = get_available_quantity(db, reservation.warehouse_id, reservation.product_id)
+        db.rollback()
         raise HTTPException(
             status_code=400,
             detail=f"Yetersiz stok. Mevcut: {available}, Talep: {reservation.quantity}"
@@ -208,10 +197,6 @@ async def reserve_stock(
     )
     db.add(db_reservation)
     
-    # Update reserved quantity
-    stock = get_or_create_warehouse_stock(db, reservation.warehouse_id, reservation.product_id)
-    stock.reserved_quantity = (stock.reserved_quantity or Decimal("0")) + reservation.quantity
-    
     db.commit()
     db.refresh(db_reservation)
     
@@ -225,7 +210,10 @@ async def cancel_reservation(
     current_user = Depends(get_current_user)
 ):
     """Cancel stock reservation"""
-    reservation = db.query(StockReservation).filter(StockReservation.id == reservation_id).first()
+    # Lock the reservation so it cannot be cancelled/fulfilled twice concurrently
+    reservation = db.query(StockReservation).filter(
+        StockReservation.id == reservation_id
+    ).with_for_update().first()
     if not reservation:
         raise HTTPException(status_code=404, detail="Rezervasyon bulunamadı")
     
@@ -233,13 +221,12 @@ async def cancel_reservation(
         raise HTTPException(status_code=400, detail="Sadece aktif rezervasyonlar iptal edilebilir")
     
     # Release reserved quantity
-    stock = db.query(WarehouseStock).filter(
-        WarehouseStock.warehouse_id == reservation.warehouse_id,
-        WarehouseStock.product_id == reservation.product_id
-    ).first()
+    key = (reservation.warehouse_id, reservation.product_id)
+    stock = load_warehouse_stocks(db, [key], for_update=True).get(key)
     
     if stock:
-        stock.reserved_quantity = max(Decimal("0"), (stock.reserved_quantity or Decimal("0")) - reservation.quantity)
+        release = min(reservation.quantity, stock.reserved_quantity or Decimal("0"))
+        change_warehouse_stock(db, *key, reserved_delta=-release)
     
     reservation.status = ReservationStatus.CANCELLED.value
     
@@ -255,22 +242,28 @@ async def fulfill_reservation(
     current_user = Depends(get_current_user)
 ):
     """Fulfill stock reservation - deduct from stock"""
-    reservation = db.query(StockReservation).filter(StockReservation.id == reservation_id).first()
+    # Lock the reservation so it cannot be cancelled/fulfilled twice concurrently
+    reservation = db.query(StockReservation).filter(
+        StockReservation.id == reservation_id
+    ).with_for_update().first()
     if not reservation:
         raise HTTPException(status_code=404, detail="Rezervasyon bulunamadı")
     
     if reservation.status != ReservationStatus.ACTIVE.value:
         raise HTTPException(status_code=400, detail="Sadece aktif rezervasyonlar tamamlanabilir")
     
-    # Deduct from stock
-    stock = db.query(WarehouseStock).filter(
-        WarehouseStock.warehouse_id == reservation.warehouse_id,
-        WarehouseStock.product_id == reservation.product_id
-    ).first()
+    # Deduct from stock, consuming the reserved quantity
+    key = (reservation.warehouse_id, reservation.product_id)
+    stock = load_warehouse_stocks(db, [key], for_update=True).get(key)
     
     if stock:
-        stock.quantity -= reservation.quantity
-        stock.reserved_quantity = max(Decimal("0"), (stock.reserved_quantity or Decimal("0")) - reservation.quantity)
+        release = min(reservation.quantity, stock.reserved_quantity or Decimal("0"))
+        if not change_warehouse_stock(
+            db, *key,
+            quantity_delta=-reservation.quantity, reserved_delta=-release, guard=GUARD_QUANTITY
+        ):
+            db.rollback()
+            raise HTTPException(status_code=400, detail="Yetersiz stok")
     
     # Create movement record
     product = db.query(Product).filter(Product.id == reservation.product_id).first()
@@ -298,20 +291,31 @@ async def fulfill_reservation(
 
 @router.get("/movements", response_model=List[StockMovementResponse])
 async def get_stock_movements(
+    response: Response,
     project_id: Optional[int] = None,
     product_id: Optional[int] = None,
     warehouse_id: Optional[int] = None,
     movement_type: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=500),
     db: Session = Depends(get_db)
 ):
     """
-    Get stock movement history.
-    All movements must have a project_id (NOT NULL).
+    Get stock movement history, newest first.
+    
+    Paginate with `cursor`: every page that has a successor returns its token
+    in the X-Next-Cursor header. Keyset pagination over (created_at, id) seeks
+    the composite indexes, so deep pages cost the same as the first one.
+    `skip` (offset) is still accepted but ignored when a cursor is given.
     """
     query = db.query(StockMovement)
     
+    try:
+        after_cursor = keyset_before(StockMovement.created_at, StockMovement.id, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     if project_id:
         query = query.filter(StockMovement.project_id == project_id)
     
@@ -329,24 +333,38 @@ async def get_stock_movements(
     if movement_type:
         query = query.filter(StockMovement.movement_type == movement_type)
     
-    movements = query.order_by(StockMovement.created_at.desc()).offset(skip).limit(limit).all()
+    query = query.order_by(StockMovement.created_at.desc(), StockMovement.id.desc())
+    if after_cursor is not None:
+        query = query.filter(after_cursor)
+    elif skip:
+        query = query.offset(skip)
+    
+    # One extra row tells whether there is a next page
+    movements = query.limit(limit + 1).all()
+    if len(movements) > limit:
+        movements = movements[:limit]
+        last = movements[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+    
+    # Names for the whole page in one query each
+    product_ids = {mov.product_id for mov in movements}
+    warehouse_ids = {mov.from_warehouse_id for mov in movements} | {mov.to_warehouse_id for mov in movements}
+    warehouse_ids.discard(None)
+    product_names = dict(db.query(Product.id, Product.name).filter(Product.id.in_(product_ids)).all()) if product_ids else {}
+    warehouse_names = dict(db.query(Warehouse.id, Warehouse.name).filter(Warehouse.id.in_(warehouse_ids)).all()) if warehouse_ids else {}
     
     result = []
     for mov in movements:
-        product = db.query(Product).filter(Product.id == mov.product_id).first()
-        from_warehouse = db.query(Warehouse).filter(Warehouse.id == mov.from_warehouse_id).first() if mov.from_warehouse_id else None
-        to_warehouse = db.query(Warehouse).filter(Warehouse.id == mov.to_warehouse_id).first() if mov.to_warehouse_id else None
-        
         result.append({
             "id": mov.id,
             "project_id": mov.project_id,
             "product_id": mov.product_id,
-            "product_name": product.name if product else None,
+            "product_name": product_names.get(mov.product_id),
             "movement_type": mov.movement_type,
             "from_warehouse_id": mov.from_warehouse_id,
-            "from_warehouse_name": from_warehouse.name if from_warehouse else None,
+            "from_warehouse_name": warehouse_names.get(mov.from_warehouse_id),
             "to_warehouse_id": mov.to_warehouse_id,
-            "to_warehouse_name": to_warehouse.name if to_warehouse else None,
+            "to_warehouse_name": warehouse_names.get(mov.to_warehouse_id),
             "quantity": mov.quantity,
             "unit_cost": mov.unit_cost,
             "reference_type": mov.reference_type,
@@ -380,30 +398,29 @@ async def create_stock_movement(
     if movement.movement_type == MovementType.IN.value:
         if not movement.to_warehouse_id:
             raise HTTPException(status_code=400, detail="Giriş için hedef depo zorunlu")
-        stock = get_or_create_warehouse_stock(db, movement.to_warehouse_id, movement.product_id)
-        stock.quantity += movement.quantity
+        get_or_create_warehouse_stock(db, movement.to_warehouse_id, movement.product_id)
+        change_warehouse_stock(db, movement.to_warehouse_id, movement.product_id, quantity_delta=movement.quantity)
         
     elif movement.movement_type == MovementType.OUT.value:
         if not movement.from_warehouse_id:
             raise HTTPException(status_code=400, detail="Çıkış için kaynak depo zorunlu")
-        stock = db.query(WarehouseStock).filter(
-            WarehouseStock.warehouse_id == movement.from_warehouse_id,
-            WarehouseStock.product_id == movement.product_id
-        ).first()
-        if not stock or stock.quantity < movement.quantity:
+        if not change_warehouse_stock(
+            db, movement.from_warehouse_id, movement.product_id,
+            quantity_delta=-movement.quantity, guard=GUARD_QUANTITY
+        ):
+            db.rollback()
             raise HTTPException(status_code=400, detail="Yetersiz stok")
-        stock.quantity -= movement.quantity
         
     elif movement.movement_type == MovementType.ADJUSTMENT.value:
         warehouse_id = movement.to_warehouse_id or movement.from_warehouse_id
         if not warehouse_id:
             raise HTTPException(status_code=400, detail="Düzeltme için depo zorunlu")
-        stock = get_or_create_warehouse_stock(db, warehouse_id, movement.product_id)
+        get_or_create_warehouse_stock(db, warehouse_id, movement.product_id)
         # For adjustment, quantity can be positive (increase) or we use to/from to determine direction
         if movement.to_warehouse_id:
-            stock.quantity += movement.quantity
+            change_warehouse_stock(db, warehouse_id, movement.product_id, quantity_delta=movement.quantity)
         else:
-            stock.quantity -= movement.quantity
+            change_warehouse_stock(db, warehouse_id, movement.product_id, quantity_delta=-movement.quantity)
     else:
         raise HTTPException(status_code=400, detail=f"Geçersiz hareket tipi: {movement.movement_type}")
     
@@ -441,6 +458,117 @@ async def create_stock_movement(
     }
 
 
+@router.post("/movements/bulk", response_model=StockMovementBulkResponse)
+async def create_stock_movements_bulk(
+    payload: StockMovementBulkCreate,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Create many manual stock movements (IN, OUT, ADJUSTMENT) in a single transaction.
+    Used for supplier goods receipts with thousands of lines.
+    
+    - Products, warehouses and projects are validated with one IN query each
+    - Lines are checked in order against a running balance, so the same
+      negative-balance rule as POST /movements applies per line
+    - Stock levels are updated with one net delta per warehouse-product
+    - Movement rows are bulk inserted
+    
+    Invalid lines are reported per line. With all_or_nothing=true any
+    failure rejects the whole batch.
+    """
+    lines = payload.items
+    if not lines:
+        raise HTTPException(status_code=400, detail="En az bir hareket satırı gerekli")
+    
+    # Validate referenced IDs with one query per entity
+    product_ids = {line.product_id for line in lines}
+    warehouse_ids = {
+        warehouse_id
+        for line in lines
+        for warehouse_id in (line.from_warehouse_id, line.to_warehouse_id)
+        if warehouse_id
+    }
+    project_ids = {line.project_id for line in lines if line.project_id}
+    
+    product_costs = dict(
+        db.query(Product.id, Product.cost).filter(Product.id.in_(product_ids)).all()
+    )
+    known_warehouses = {
+        row.id for row in db.query(Warehouse.id).filter(Warehouse.id.in_(warehouse_ids)).all()
+    } if warehouse_ids else set()
+    known_projects = {
+        row.id for row in db.query(Project.id).filter(Project.id.in_(project_ids)).all()
+    } if project_ids else set()
+    
+    # Resolve each line to a (warehouse, product) key and signed delta
+    errors = []
+    resolved = []
+    for index, line in enumerate(lines):
+        try:
+            if line.product_id not in product_costs:
+                raise ValueError("Ürün bulunamadı")
+            if line.project_id and line.project_id not in known_projects:
+                raise ValueError("Proje bulunamadı")
+            if line.quantity <= 0:
+                raise ValueError("Miktar sıfırdan büyük olmalı")
+            warehouse_id, delta = resolve_movement_delta(line)
+            if warehouse_id not in known_warehouses:
+                raise ValueError("Depo bulunamadı")
+        except ValueError as e:
+            errors.append({"line": index, "product_id": line.product_id, "detail": str(e)})
+            continue
+        resolved.append((index, line, (warehouse_id, line.product_id), delta))
+    
+    # Load (and lock) current balances in one query and apply lines in order
+    existing = load_warehouse_stocks(db, [key for _, _, key, _ in resolved], for_update=True)
+    balances = {key: stock.quantity for key, stock in existing.items()}
+    deltas = defaultdict(Decimal)
+    movement_rows = []
+    
+    for index, line, key, delta in resolved:
+        if line.movement_type == MovementType.OUT.value:
+            balance = balances.get(key)
+            if balance is None or balance < line.quantity:
+                errors.append({"line": index, "product_id": line.product_id, "detail": "Yetersiz stok"})
+                continue
+        
+        balances[key] = balances.get(key, Decimal("0")) + delta
+        deltas[key] += delta
+        movement_rows.append({
+            "project_id": line.project_id,
+            "product_id": line.product_id,
+            "movement_type": line.movement_type,
+            "from_warehouse_id": line.from_warehouse_id,
+            "to_warehouse_id": line.to_warehouse_id,
+            "quantity": line.quantity,
+            "unit_cost": line.unit_cost or product_costs[line.product_id],
+            "notes": line.notes,
+            "created_by": current_user.id
+        })
+    
+    errors.sort(key=lambda e: e["line"])
+    
+    if errors and payload.all_or_nothing:
+        db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Toplu hareket reddedildi", "errors": errors}
+        )
+    
+    if movement_rows:
+        apply_stock_deltas(db, deltas, existing)
+        db.execute(insert(StockMovement), movement_rows)
+        db.commit()
+    
+    return {
+        "total_lines": len(lines),
+        "processed": len(movement_rows),
+        "failed": len(errors),
+        "errors": errors
+    }
+
+
 @router.get("/check-availability")
 async def check_availability(
     product_id: int,
@@ -498,3 +626,79 @@ async def check_availability(
         "reserved_for_other_projects": reserved_for_other,
         "warning": "Yetersiz stok" if total_available < quantity else None
     }
+
+
+@router.get("/as-of")
+async def get_stock_as_of_date(
+    date: datetime,
+    warehouse_id: Optional[int] = None,
+    product_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Get warehouse stock quantities at a past moment (e.g. month-end).
+    Starts from the nearest stored snapshot and replays only the
+    stock movements written after it.
+    """
+    ledger = get_stock_as_of(db, date, warehouse_id=warehouse_id, product_id=product_id)
+    balances = ledger["balances"]
+    
+    # Names with one query per entity
+    product_ids = {pid for _, pid in balances}
+    warehouse_ids = {wid for wid, _ in balances}
+    products = {
+        p.id: p for p in db.query(Product.id, Product.sku, Product.name).filter(Product.id.in_(product_ids)).all()
+    } if product_ids else {}
+    warehouse_names = dict(
+        db.query(Warehouse.id, Warehouse.name).filter(Warehouse.id.in_(warehouse_ids)).all()
+    ) if warehouse_ids else {}
+    
+    items = []
+    for (wid, pid), quantity in sorted(balances.items()):
+        product = products.get(pid)
+        items.append({
+            "warehouse_id": wid,
+            "warehouse_name": warehouse_names.get(wid),
+            "product_id": pid,
+            "product_sku": product.sku if product else None,
+            "product_name": product.name if product else None,
+            "quantity": float(quantity)
+        })
+    
+    return {
+        "as_of": ledger["as_of"],
+        "snapshot_id": ledger["snapshot_id"],
+        "snapshot_at": ledger["snapshot_at"],
+        "movements_replayed": ledger["movements_replayed"],
+        "items": items
+    }
+
+
+@router.get("/snapshots", response_model=List[StockSnapshotResponse])
+async def get_stock_snapshots(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """List stored stock ledger snapshots (newest first)"""
+    return db.query(StockSnapshot).order_by(
+        StockSnapshot.snapshot_at.desc()
+    ).offset(skip).limit(limit).all()
+
+
+@router.post("/snapshots", response_model=StockSnapshotResponse, status_code=status.HTTP_201_CREATED)
+async def create_stock_snapshot(
+    snapshot_data: StockSnapshotCreate,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    """
+    Write a stock ledger snapshot on demand.
+    Snapshots are also written daily by the background scheduler.
+    """
+    snapshot = write_stock_snapshot(db, snapshot_data.snapshot_at)
+    db.commit()
+    db.refresh(snapshot)
+    return snapshot
@@ -430,6 +430,42 @@ class StockMovementResponse(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class StockMovementBulkCreate(BaseModel):
+    """Create many manual stock movements in one transaction"""
+    items: List[StockMovementCreate]
+    all_or_nothing: bool = False  # Reject the whole batch if any line fails
+
+
+class StockMovementBulkError(BaseModel):
+    """Failed line of a bulk stock movement request"""
+    line: int  # 0-based index in items
+    product_id: int
+    detail: str
+
+
+class StockMovementBulkResponse(BaseModel):
+    """Bulk stock movement result"""
+    total_lines: int
+    processed: int
+    failed: int
+    errors: List[StockMovementBulkError] = []
+
+
+class StockSnapshotCreate(BaseModel):
+    """Write a stock ledger snapshot (default: now)"""
+    snapshot_at: Optional[datetime] = None
+
+
+class StockSnapshotResponse(BaseModel):
+    """Stock ledger snapshot"""
+    id: int
+    snapshot_at: datetime
+    line_count: int
+    created_at: Optional[datetime] = None
+    
+    model_config = ConfigDict(from_attributes=True)
+
+
 # ===== INVOICE SCHEMAS =====
 
 class InvoiceItemBase(BaseModel):
@@ -0,0 +1,35 @@
+"""
+Background Scheduler
+APScheduler jobs started from the application lifespan
+"""
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+
+from app.config import settings
+from app.services.stock_ledger import run_stock_snapshot_job
+
+
+scheduler = BackgroundScheduler()
+
+
+def start_scheduler() -> None:
+    """Register jobs and start the scheduler (no-op if disabled or already running)"""
+    if not settings.SCHEDULER_ENABLED or scheduler.running:
+        return
+    
+    scheduler.add_job(
+        run_stock_snapshot_job,
+        CronTrigger(hour=settings.STOCK_SNAPSHOT_HOUR, minute=settings.STOCK_SNAPSHOT_MINUTE),
+        id="stock_snapshot",
+        replace_existing=True,
+        coalesce=True,
+        max_instances=1
+    )
+    
+    scheduler.start()
+
+
+def shutdown_scheduler() -> None:
+    """Stop the scheduler without waiting for running jobs"""
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
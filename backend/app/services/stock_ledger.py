@@ -0,0 +1,215 @@
+"""
+Stock Ledger Service
+Point-in-time stock balances rebuilt from snapshots and the stock_movements log
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, or_, func
+from typing import Dict, Optional, Tuple
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from app.database import SessionLocal
+from app.models import StockMovement, StockSnapshot, StockSnapshotLine
+
+
+# (warehouse_id, product_id)
+StockKey = Tuple[int, int]
+
+REPLAY_BATCH_SIZE = 1000
+
+# Scheduled snapshots stay this far behind "now" so movements of
+# transactions still in flight are not skipped by both snapshot and replay
+SNAPSHOT_SAFETY_LAG = timedelta(minutes=5)
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    """Normalize a datetime to naive UTC, the format movement timestamps are stored in"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def find_base_snapshot(db: Session, as_of: datetime) -> Optional[StockSnapshot]:
+    """Nearest snapshot taken at or before as_of"""
+    return db.query(StockSnapshot).filter(
+        StockSnapshot.snapshot_at <= as_of
+    ).order_by(StockSnapshot.snapshot_at.desc(), StockSnapshot.id.desc()).first()
+
+
+def load_snapshot_balances(
+    db: Session,
+    snapshot: Optional[StockSnapshot],
+    warehouse_id: Optional[int] = None,
+    product_id: Optional[int] = None
+) -> Dict[StockKey, Decimal]:
+    """Load the stored balances of a snapshot"""
+    balances = defaultdict(Decimal)
+    if snapshot is None:
+        return balances
+
+    query = db.query(
+        StockSnapshotLine.warehouse_id,
+        StockSnapshotLine.product_id,
+        StockSnapshotLine.quantity
+    ).filter(StockSnapshotLine.snapshot_id == snapshot.id)
+
+    if warehouse_id:
+        query = query.filter(StockSnapshotLine.warehouse_id == warehouse_id)
+    if product_id:
+        query = query.filter(StockSnapshotLine.product_id == product_id)
+
+    for row in query.all():
+        balances[(row.warehouse_id, row.product_id)] = Decimal(row.quantity)
+
+    return balances
+
+
+def replay_movements(
+    db: Session,
+    balances: Dict[StockKey, Decimal],
+    after: Optional[datetime],
+    until: datetime,
+    warehouse_id: Optional[int] = None,
+    product_id: Optional[int] = None
+) -> int:
+    """
+    Apply movements in (after, until] to balances in one ordered streaming pass.
+    Quantity leaves from_warehouse_id and enters to_warehouse_id, which covers
+    every movement type. Returns the number of movements replayed.
+    """
+    query = db.query(
+        StockMovement.product_id,
+        StockMovement.from_warehouse_id,
+        StockMovement.to_warehouse_id,
+        StockMovement.quantity
+    ).filter(StockMovement.created_at <= until)
+
+    if after is not None:
+        query = query.filter(StockMovement.created_at > after)
+    if warehouse_id:
+        query = query.filter(
+            or_(
+                StockMovement.from_warehouse_id == warehouse_id,
+                StockMovement.to_warehouse_id == warehouse_id
+            )
+        )
+    if product_id:
+        query = query.filter(StockMovement.product_id == product_id)
+
+    query = query.order_by(StockMovement.created_at, StockMovement.id).yield_per(REPLAY_BATCH_SIZE)
+
+    replayed = 0
+    for movement in query:
+        quantity = Decimal(movement.quantity)
+        if movement.from_warehouse_id and (not warehouse_id or movement.from_warehouse_id == warehouse_id):
+            balances[(movement.from_warehouse_id, movement.product_id)] -= quantity
+        if movement.to_warehouse_id and (not warehouse_id or movement.to_warehouse_id == warehouse_id):
+            balances[(movement.to_warehouse_id, movement.product_id)] += quantity
+        replayed += 1
+
+    return replayed
+
+
+def get_stock_as_of(
+    db: Session,
+    as_of: datetime,
+    warehouse_id: Optional[int] = None,
+    product_id: Optional[int] = None
+) -> dict:
+    """
+    Rebuild warehouse stock quantities at a past moment.
+    Starts from the nearest snapshot and replays only the movements after it.
+    """
+    as_of = to_utc_naive(as_of)
+    snapshot = find_base_snapshot(db, as_of)
+
+    balances = load_snapshot_balances(db, snapshot, warehouse_id, product_id)
+    replayed = replay_movements(
+        db,
+        balances,
+        after=snapshot.snapshot_at if snapshot else None,
+        until=as_of,
+        warehouse_id=warehouse_id,
+        product_id=product_id
+    )
+
+    return {
+        "as_of": as_of,
+        "snapshot_id": snapshot.id if snapshot else None,
+        "snapshot_at": snapshot.snapshot_at if snapshot else None,
+        "movements_replayed": replayed,
+        "balances": {key: quantity for key, quantity in balances.items() if quantity != 0}
+    }
+
+
+def write_stock_snapshot(db: Session, snapshot_at: Optional[datetime] = None) -> StockSnapshot:
+    """
+    Write a snapshot of all warehouse balances as of snapshot_at
+    (default: now minus SNAPSHOT_SAFETY_LAG).
+
+    Balances are derived from the previous snapshot plus the movements written
+    since, aggregated in SQL per (warehouse, product), so a snapshot always
+    agrees with the movement ledger. Only non-zero balances are stored.
+    Does not commit - the caller owns the transaction.
+    """
+    snapshot_at = to_utc_naive(snapshot_at or datetime.utcnow() - SNAPSHOT_SAFETY_LAG)
+    previous = find_base_snapshot(db, snapshot_at)
+
+    balances = load_snapshot_balances(db, previous)
+
+    window = [StockMovement.created_at <= snapshot_at]
+    if previous is not None:
+        window.append(StockMovement.created_at > previous.snapshot_at)
+
+    incoming = db.query(
+        StockMovement.to_warehouse_id,
+        StockMovement.product_id,
+        func.sum(StockMovement.quantity)
+    ).filter(
+        StockMovement.to_warehouse_id.isnot(None), *window
+    ).group_by(StockMovement.to_warehouse_id, StockMovement.product_id)
+
+    outgoing = db.query(
+        StockMovement.from_warehouse_id,
+        StockMovement.product_id,
+        func.sum(StockMovement.quantity)
+    ).filter(
+        StockMovement.from_warehouse_id.isnot(None), *window
+    ).group_by(StockMovement.from_warehouse_id, StockMovement.product_id)
+
+    for warehouse_id, product_id, quantity in incoming.all():
+        balances[(warehouse_id, product_id)] += Decimal(str(quantity))
+    for warehouse_id, product_id, quantity in outgoing.all():
+        balances[(warehouse_id, product_id)] -= Decimal(str(quantity))
+
+    lines = [
+        {"warehouse_id": warehouse_id, "product_id": product_id, "quantity": quantity}
+        for (warehouse_id, product_id), quantity in balances.items()
+        if quantity != 0
+    ]
+
+    snapshot = StockSnapshot(snapshot_at=snapshot_at, line_count=len(lines))
+    db.add(snapshot)
+    db.flush()
+
+    if lines:
+        for line in lines:
+            line["snapshot_id"] = snapshot.id
+        db.execute(insert(StockSnapshotLine), lines)
+
+    return snapshot
+
+
+def run_stock_snapshot_job() -> None:
+    """Scheduled job: write a snapshot of the current stock ledger"""
+    db = SessionLocal()
+    try:
+        snapshot = write_stock_snapshot(db)
+        db.commit()
+        print(f"📸 Stok snapshot alındı: {snapshot.snapshot_at} ({snapshot.line_count} satır)")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Stok snapshot hatası: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,321 @@
+"""
+Stock Service
+Shared stock arithmetic used by the stock, delivery note and service form routers
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, update, delete, bindparam, func
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict
+from decimal import Decimal
+
+from app.database import dialect_insert
+from app.models import WarehouseStock, ProductStockTotal, MovementType
+from app.models.warehouse import apply_product_stock_total_deltas
+
+
+# (warehouse_id, product_id)
+StockKey = Tuple[int, int]
+
+QUANTITY_SCALE = Decimal("0.001")  # Numeric(15, 3)
+
+# Guards for change_warehouse_stock
+GUARD_AVAILABLE = "available"  # quantity - reserved_quantity must stay >= 0
+GUARD_QUANTITY = "quantity"    # quantity must stay >= 0 (reserved stock may be consumed)
+
+
+def _quantity(value) -> Decimal:
+    """Normalize a DB quantity (Decimal or float on SQLite) to Numeric(15, 3) precision"""
+    return Decimal(str(value or 0)).quantize(QUANTITY_SCALE)
+
+
+def resolve_movement_delta(movement) -> Tuple[int, Decimal]:
+    """
+    Resolve which warehouse a manual movement (IN, OUT, ADJUSTMENT) touches
+    and the signed quantity change it causes.
+    Raises ValueError with a user facing message for invalid movements.
+    """
+    if movement.movement_type == MovementType.IN.value:
+        if not movement.to_warehouse_id:
+            raise ValueError("Giriş için hedef depo zorunlu")
+        return movement.to_warehouse_id, movement.quantity
+
+    if movement.movement_type == MovementType.OUT.value:
+        if not movement.from_warehouse_id:
+            raise ValueError("Çıkış için kaynak depo zorunlu")
+        return movement.from_warehouse_id, -movement.quantity
+
+    if movement.movement_type == MovementType.ADJUSTMENT.value:
+        warehouse_id = movement.to_warehouse_id or movement.from_warehouse_id
+        if not warehouse_id:
+            raise ValueError("Düzeltme için depo zorunlu")
+        # to_warehouse = increase, from_warehouse = decrease
+        if movement.to_warehouse_id:
+            return warehouse_id, movement.quantity
+        return warehouse_id, -movement.quantity
+
+    raise ValueError(f"Geçersiz hareket tipi: {movement.movement_type}")
+
+
+def get_or_create_warehouse_stock(db: Session, warehouse_id: int, product_id: int) -> WarehouseStock:
+    """
+    Get or create warehouse stock record.
+    Creation is an INSERT ... ON CONFLICT DO NOTHING on (warehouse_id, product_id),
+    so two concurrent requests never create duplicate rows.
+    """
+    query = db.query(WarehouseStock).filter(
+        WarehouseStock.warehouse_id == warehouse_id,
+        WarehouseStock.product_id == product_id
+    )
+
+    stock = query.first()
+    if stock:
+        return stock
+
+    insert_stmt = dialect_insert(db.get_bind().dialect.name)(WarehouseStock.__table__).values(
+        warehouse_id=warehouse_id,
+        product_id=product_id,
+        quantity=Decimal("0"),
+        reserved_quantity=Decimal("0")
+    ).on_conflict_do_nothing(index_elements=["warehouse_id", "product_id"])
+    result = db.execute(insert_stmt)
+
+    if result.rowcount:
+        # Core insert bypasses the mapper events, create the (zero) totals row here
+        apply_product_stock_total_deltas(db.connection(), {product_id: (Decimal("0"), Decimal("0"))})
+
+    return query.first()
+
+
+def load_warehouse_stocks(
+    db: Session,
+    keys: Iterable[StockKey],
+    for_update: bool = False
+) -> Dict[StockKey, WarehouseStock]:
+    """
+    Load existing warehouse stock rows for many (warehouse, product) pairs in one query.
+    With for_update=True the rows are locked (SELECT ... FOR UPDATE on PostgreSQL)
+    in id order, so concurrent writers always lock in the same order.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+
+    warehouse_ids = {warehouse_id for warehouse_id, _ in keys}
+    product_ids = {product_id for _, product_id in keys}
+
+    query = db.query(WarehouseStock).filter(
+        WarehouseStock.warehouse_id.in_(warehouse_ids),
+        WarehouseStock.product_id.in_(product_ids)
+    )
+    if for_update:
+        query = query.order_by(WarehouseStock.id).with_for_update()
+    rows = query.all()
+
+    return {
+        (row.warehouse_id, row.product_id): row
+        for row in rows
+        if (row.warehouse_id, row.product_id) in keys
+    }
+
+
+def change_warehouse_stock(
+    db: Session,
+    warehouse_id: int,
+    product_id: int,
+    quantity_delta: Decimal = Decimal("0"),
+    reserved_delta: Decimal = Decimal("0"),
+    guard: Optional[str] = None
+) -> bool:
+    """
+    Atomically add deltas to one warehouse stock row in SQL
+    (quantity = quantity + :delta), instead of read-modify-write in Python.
+
+    guard=GUARD_AVAILABLE / GUARD_QUANTITY adds the check to the WHERE clause,
+    e.g. "quantity - reserved_quantity >= :x" for a decrement of x. Returns
+    False when the row does not exist or the guard rejected the change.
+    Does not commit - the caller owns the transaction.
+    """
+    table = WarehouseStock.__table__
+    new_quantity = table.c.quantity + quantity_delta
+    new_reserved = func.coalesce(table.c.reserved_quantity, 0) + reserved_delta
+
+    stmt = update(table).where(
+        table.c.warehouse_id == warehouse_id,
+        table.c.product_id == product_id
+    ).values(
+        quantity=new_quantity,
+        reserved_quantity=new_reserved,
+        updated_at=func.now()
+    )
+
+    if guard == GUARD_AVAILABLE:
+        stmt = stmt.where(new_quantity - new_reserved >= 0)
+    elif guard == GUARD_QUANTITY:
+        stmt = stmt.where(new_quantity >= 0)
+
+    result = db.execute(stmt)
+    if not result.rowcount:
+        return False
+
+    # Core statements bypass the WarehouseStock mapper events
+    apply_product_stock_total_deltas(db.connection(), {product_id: (quantity_delta, reserved_delta)})
+
+    # A row already loaded into the session is now stale
+    for obj in db.identity_map.values():
+        if isinstance(obj, WarehouseStock) and obj.warehouse_id == warehouse_id and obj.product_id == product_id:
+            db.expire(obj)
+            break
+
+    return True
+
+
+def get_available_quantity(db: Session, warehouse_id: int, product_id: int) -> Decimal:
+    """Current available (non-reserved) quantity, used for error messages"""
+    stock = db.query(
+        WarehouseStock.quantity,
+        WarehouseStock.reserved_quantity
+    ).filter(
+        WarehouseStock.warehouse_id == warehouse_id,
+        WarehouseStock.product_id == product_id
+    ).first()
+
+    if not stock:
+        return Decimal("0")
+    return _quantity(stock.quantity) - _quantity(stock.reserved_quantity)
+
+
+def apply_stock_deltas(
+    db: Session,
+    deltas: Dict[StockKey, Decimal],
+    existing: Dict[StockKey, WarehouseStock]
+) -> None:
+    """
+    Apply net quantity deltas per (warehouse, product) in aggregate.
+
+    Existing rows are updated with a single executemany UPDATE
+    (quantity = quantity + delta), missing rows are bulk upserted.
+    Does not commit - the caller owns the transaction.
+    """
+    table = WarehouseStock.__table__
+
+    updates = []
+    inserts = []
+    for (warehouse_id, product_id), delta in deltas.items():
+        stock = existing.get((warehouse_id, product_id))
+        if stock is not None:
+            if delta:
+                updates.append({"stock_id": stock.id, "delta": delta})
+        else:
+            inserts.append({
+                "warehouse_id": warehouse_id,
+                "product_id": product_id,
+                "quantity": delta,
+                "reserved_quantity": Decimal("0")
+            })
+
+    if updates:
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("stock_id"))
+            .values(
+                quantity=table.c.quantity + bindparam("delta", type_=table.c.quantity.type),
+                updated_at=func.now()
+            )
+        )
+        db.execute(stmt, updates)
+
+    if inserts:
+        # A concurrent request may have created the row meanwhile - add to it then
+        insert_stmt = dialect_insert(db.get_bind().dialect.name)(table)
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=["warehouse_id", "product_id"],
+            set_={
+                "quantity": table.c.quantity + insert_stmt.excluded.quantity,
+                "updated_at": func.now()
+            }
+        )
+        db.execute(insert_stmt, inserts)
+
+    # Core statements bypass the WarehouseStock mapper events,
+    # so keep product_stock_totals in step here
+    product_deltas = defaultdict(lambda: (Decimal("0"), Decimal("0")))
+    for (_, product_id), delta in deltas.items():
+        quantity_delta, reserved_delta = product_deltas[product_id]
+        product_deltas[product_id] = (quantity_delta + delta, reserved_delta)
+    apply_product_stock_total_deltas(db.connection(), product_deltas)
+
+    # Rows loaded into the session are now stale
+    for stock in existing.values():
+        db.expire(stock)
+
+
+def rebuild_product_stock_totals(
+    db: Session,
+    product_ids: Optional[Iterable[int]] = None,
+    dry_run: bool = False
+) -> List[dict]:
+    """
+    Recompute product_stock_totals from warehouse_stocks.
+
+    Returns the products whose stored totals drifted from the recomputed
+    values. With dry_run=True nothing is written (drift check only).
+    Does not commit - the caller owns the transaction.
+    """
+    stock_query = db.query(
+        WarehouseStock.product_id,
+        func.coalesce(func.sum(WarehouseStock.quantity), 0).label("total_quantity"),
+        func.coalesce(func.sum(WarehouseStock.reserved_quantity), 0).label("total_reserved")
+    ).group_by(WarehouseStock.product_id)
+    totals_query = db.query(ProductStockTotal)
+
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        stock_query = stock_query.filter(WarehouseStock.product_id.in_(product_ids))
+        totals_query = totals_query.filter(ProductStockTotal.product_id.in_(product_ids))
+
+    expected = {
+        row.product_id: (_quantity(row.total_quantity), _quantity(row.total_reserved))
+        for row in stock_query.all()
+    }
+    stored = {
+        row.product_id: (_quantity(row.total_quantity), _quantity(row.total_reserved))
+        for row in totals_query.all()
+    }
+
+    drift = []
+    for product_id in sorted(expected.keys() | stored.keys()):
+        expected_qty, expected_reserved = expected.get(product_id, (Decimal("0"), Decimal("0")))
+        stored_qty, stored_reserved = stored.get(product_id, (Decimal("0"), Decimal("0")))
+        missing = product_id in expected and product_id not in stored
+        if missing or expected_qty != stored_qty or expected_reserved != stored_reserved:
+            drift.append({
+                "product_id": product_id,
+                "stored_quantity": float(stored_qty),
+                "expected_quantity": float(expected_qty),
+                "stored_reserved": float(stored_reserved),
+                "expected_reserved": float(expected_reserved)
+            })
+
+    if dry_run or not drift:
+        return drift
+
+    table = ProductStockTotal.__table__
+    delete_stmt = delete(table)
+    if product_ids is not None:
+        delete_stmt = delete_stmt.where(table.c.product_id.in_(product_ids))
+    db.execute(delete_stmt)
+
+    rows = [
+        {
+            "product_id": product_id,
+            "total_quantity": quantity,
+            "total_reserved": reserved,
+            "available": quantity - reserved
+        }
+        for product_id, (quantity, reserved) in expected.items()
+    ]
+    if rows:
+        db.execute(insert(table), rows)
+    db.expire_all()
+
+    return drift
@@ -0,0 +1,47 @@
+"""
+Pagination Utilities
+Opaque keyset cursors over (created_at, id)
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode the sort key of the last row of a page as an opaque token"""
+    payload = json.dumps({"t": created_at.isoformat(), "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a token created by encode_cursor.
+    Raises ValueError for malformed tokens.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Geçersiz cursor") from e
+
+
+def keyset_before(created_at_column, id_column, cursor: Optional[str]):
+    """
+    WHERE clause for the next page of a (created_at DESC, id DESC) ordering:
+    rows strictly after the cursor row. Returns None when there is no cursor.
+
+    The leading created_at <= :t bound lets the database seek a
+    (created_at, id) index instead of scanning from the first page.
+    """
+    if not cursor:
+        return None
+
+    created_at, row_id = decode_cursor(cursor)
+    return and_(
+        created_at_column <= created_at,
+        or_(created_at_column < created_at, id_column < row_id)
+    )
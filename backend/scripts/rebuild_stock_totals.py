@@ -0,0 +1,70 @@
+"""
+Product stock totals rebuild script
+Recomputes product_stock_totals from warehouse_stocks and reports drift
+"""
+import sys
+import os
+import argparse
+
+# Parse arguments FIRST, before any imports
+parser = argparse.ArgumentParser(description="Rebuild product_stock_totals from warehouse_stocks")
+parser.add_argument("--check", action="store_true", help="Only report drift, do not write")
+parser.add_argument("--test", action="store_true", help="Use test database (SQLite)")
+
+args = parser.parse_args()
+
+# Set environment BEFORE importing app modules
+if args.test:
+    os.environ["ENVIRONMENT"] = "testing"
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Now import app modules (they will use the correct environment)
+from app.database import SessionLocal, create_tables
+from app.services.stock_service import rebuild_product_stock_totals
+from app.config import settings
+
+
+def rebuild(check_only: bool) -> int:
+    """Rebuild (or check) product stock totals, returns number of drifted products"""
+    print(f"🔧 Environment: {settings.ENVIRONMENT}")
+    print(f"📦 Database: {settings.active_database_url}")
+    print()
+
+    # Make sure product_stock_totals exists on older databases
+    create_tables()
+
+    db = SessionLocal()
+    try:
+        drift = rebuild_product_stock_totals(db, dry_run=check_only)
+
+        for row in drift:
+            print(
+                f"   ⚠️  Ürün {row['product_id']}: "
+                f"miktar {row['stored_quantity']} -> {row['expected_quantity']}, "
+                f"rezerve {row['stored_reserved']} -> {row['expected_reserved']}"
+            )
+
+        if check_only:
+            db.rollback()
+            print(f"\n📋 {len(drift)} product(s) drifted")
+        else:
+            db.commit()
+            print(f"\n✅ Rebuilt totals, {len(drift)} product(s) corrected")
+
+        return len(drift)
+    except Exception as e:
+        print(f"❌ Error rebuilding totals: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    drifted = rebuild(args.check)
+
+    # Non-zero exit code lets cron/CI alert on drift
+    if args.check and drifted:
+        sys.exit(1)
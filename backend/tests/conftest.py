@@ -7,3 +7,9 @@ import os
 
 # Set test environment
 os.environ["ENVIRONMENT"] = "testing"
+
+# Create tables added since the test database was generated
+from app.database import create_tables
+import app.models  # noqa: F401 - register all models
+
+create_tables()
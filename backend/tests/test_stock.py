@@ -22,8 +22,8 @@ def get_auth_header():
 
 def create_test_product(headers):
     """Helper to create a test product"""
-    import time
-    sku = f"STOCK-{int(time.time())}"
+    import uuid
+    sku = f"STOCK-{uuid.uuid4().hex[:8]}"
     response = client.post(
         "/api/products/",
         json={"sku": sku, "name": "Stock Test Product"},
@@ -34,8 +34,8 @@ def create_test_product(headers):
 
 def create_test_warehouse(headers):
     """Helper to create a test warehouse"""
-    import time
-    code = f"STOCKWH-{int(time.time())}"
+    import uuid
+    code = f"STOCKWH-{uuid.uuid4().hex[:8]}"
     response = client.post(
         "/api/warehouses/",
         json={"name": "Stock Test Warehouse", "code": code, "warehouse_type": "PHYSICAL"},
@@ -136,6 +136,51 @@ class TestStockMovements:
             )
             assert response.status_code == 200
             assert response.json()["movement_type"] == "IN"
+    
+    def test_get_stock_movements_cursor_pagination(self):
+        """Test walking movement history with next cursors"""
+        headers = get_auth_header()
+        
+        product_id = create_test_product(headers)
+        warehouse_id = create_test_warehouse(headers)
+        project_id = create_test_project(headers)
+        
+        for quantity in range(1, 6):
+            client.post(
+                "/api/stock/movements",
+                json={
+                    "project_id": project_id,
+                    "product_id": product_id,
+                    "movement_type": "IN",
+                    "to_warehouse_id": warehouse_id,
+                    "quantity": quantity
+                },
+                headers=headers
+            )
+        
+        ids = []
+        pages = 0
+        params = {"product_id": product_id, "limit": 2}
+        while True:
+            response = client.get("/api/stock/movements", params=params, headers=headers)
+            assert response.status_code == 200
+            ids.extend(item["id"] for item in response.json())
+            pages += 1
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if not next_cursor:
+                break
+            params["cursor"] = next_cursor
+        
+        # Movements created in the same second are ordered by id
+        assert pages == 3
+        assert ids == sorted(ids, reverse=True)
+        assert len(set(ids)) == 5
+    
+    def test_get_stock_movements_invalid_cursor(self):
+        """Test malformed cursor is rejected"""
+        headers = get_auth_header()
+        response = client.get("/api/stock/movements?cursor=bozuk", headers=headers)
+        assert response.status_code == 400
 
 
 class TestStockReservation:
@@ -201,3 +246,264 @@ class TestStockAvailability:
         assert response.status_code == 200
         assert "available" in response.json()
         assert "total_available" in response.json()
+
+
+class TestStockBulkMovements:
+    """Tests for bulk stock movement endpoint"""
+    
+    def test_bulk_movements_apply_net_deltas(self):
+        """Test bulk IN/OUT lines are applied in order and aggregated"""
+        headers = get_auth_header()
+        
+        product_id = create_test_product(headers)
+        warehouse_id = create_test_warehouse(headers)
+        project_id = create_test_project(headers)
+        
+        response = client.post(
+            "/api/stock/movements/bulk",
+            json={
+                "items": [
+                    {"project_id": project_id, "product_id": product_id, "movement_type": "IN", "to_warehouse_id": warehouse_id, "quantity": 40},
+                    {"project_id": project_id, "product_id": product_id, "movement_type": "IN", "to_warehouse_id": warehouse_id, "quantity": 10},
+                    {"project_id": project_id, "product_id": product_id, "movement_type": "OUT", "from_warehouse_id": warehouse_id, "quantity": 20}
+                ]
+            },
+            headers=headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["processed"] == 3
+        assert data["failed"] == 0
+        
+        availability = client.get(
+            f"/api/stock/check-availability?product_id={product_id}&quantity=1&warehouse_id={warehouse_id}",
+            headers=headers
+        ).json()
+        assert availability["total_available"] == 30
+    
+    def test_bulk_movements_report_failed_lines(self):
+        """Test invalid and insufficient lines are reported per line"""
+        headers = get_auth_header()
+        
+        product_id = create_test_product(headers)
+        warehouse_id = create_test_warehouse(headers)
+        project_id = create_test_project(headers)
+        
+        response = client.post(
+            "/api/stock/movements/bulk",
+            json={
+                "items": [
+                    {"project_id": project_id, "product_id": product_id, "movement_type": "IN", "to_warehouse_id": warehouse_id, "quantity": 5},
+                    {"project_id": project_id, "product_id": product_id, "movement_type": "OUT", "from_warehouse_id": warehouse_id, "quantity": 6},
+                    {"project_id": project_id, "product_id": 99999999, "movement_type": "IN", "to_warehouse_id": warehouse_id, "quantity": 1}
+                ]
+            },
+            headers=headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["processed"] == 1
+        assert [e["line"] for e in data["errors"]] == [1, 2]
+    
+    def test_bulk_movements_all_or_nothing(self):
+        """Test all_or_nothing rejects the whole batch"""
+        headers = get_auth_header()
+        
+        product_id = create_test_product(headers)
+        warehouse_id = create_test_warehouse(headers)
+        project_id = create_test_project(headers)
+        
+        response = client.post(
+            "/api/stock/movements/bulk",
+            json={
+                "all_or_nothing": True,
+                "items": [
+                    {"project_id": project_id, "product_id": product_id, "movement_type": "IN", "to_warehouse_id": warehouse_id, "quantity": 5},
+                    {"project_id": project_id, "product_id": product_id, "movement_type": "OUT", "from_warehouse_id": warehouse_id, "quantity": 50}
+                ]
+            },
+            headers=headers
+        )
+        assert response.status_code == 400
+
+
+class TestProductStockTotals:
+    """Tests for incrementally maintained product stock totals"""
+    
+    def test_totals_follow_stock_changes(self):
+        """Test product totals are updated with movements and reservations"""
+        from app.database import SessionLocal
+        from app.services.stock_service import rebuild_product_stock_totals
+        
+        headers = get_auth_header()
+        
+        product_id = create_test_product(headers)
+        warehouse_id = create_test_warehouse(headers)
+        project_id = create_test_project(headers)
+        
+        client.post(
+            "/api/stock/movements",
+            json={
+                "project_id": project_id,
+                "product_id": product_id,
+                "movement_type": "IN",
+                "to_warehouse_id": warehouse_id,
+                "quantity": 30
+            },
+            headers=headers
+        )
+        client.post(
+            "/api/stock/movements/bulk",
+            json={"items": [{
+                "project_id": project_id,
+                "product_id": product_id,
+                "movement_type": "OUT",
+                "from_warehouse_id": warehouse_id,
+                "quantity": 5
+            }]},
+            headers=headers
+        )
+        client.post(
+            "/api/stock/reserve",
+            json={
+                "project_id": project_id,
+                "product_id": product_id,
+                "warehouse_id": warehouse_id,
+                "quantity": 10
+            },
+            headers=headers
+        )
+        
+        product = client.get(f"/api/products/{product_id}", headers=headers).json()
+        assert float(product["total_stock"]) == 25
+        assert float(product["available_stock"]) == 15
+        
+        db = SessionLocal()
+        try:
+            assert rebuild_product_stock_totals(db, [product_id], dry_run=True) == []
+        finally:
+            db.close()
+
+
+class TestStockAsOf:
+    """Tests for point-in-time stock ledger"""
+    
+    def test_stock_as_of_replays_after_snapshot(self):
+        """Test as-of balances start from a snapshot and replay later movements"""
+        import time
+        from datetime import datetime
+        
+        headers = get_auth_header()
+        
+        product_id = create_test_product(headers)
+        warehouse_id = create_test_warehouse(headers)
+        project_id = create_test_project(headers)
+        
+        before = datetime.utcnow().isoformat()
+        time.sleep(1.1)
+        
+        movement = {
+            "project_id": project_id,
+            "product_id": product_id,
+            "movement_type": "IN",
+            "to_warehouse_id": warehouse_id,
+            "quantity": 10
+        }
+        client.post("/api/stock/movements", json=movement, headers=headers)
+        time.sleep(1.1)
+        
+        snapshot_response = client.post(
+            "/api/stock/snapshots",
+            json={"snapshot_at": datetime.utcnow().isoformat()},
+            headers=headers
+        )
+        assert snapshot_response.status_code == 201
+        snapshot_id = snapshot_response.json()["id"]
+        time.sleep(1.1)
+        
+        client.post("/api/stock/movements", json={**movement, "quantity": 5}, headers=headers)
+        time.sleep(1.1)
+        
+        response = client.get(
+            f"/api/stock/as-of?date={datetime.utcnow().isoformat()}&product_id={product_id}",
+            headers=headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["snapshot_id"] == snapshot_id
+        assert data["movements_replayed"] == 1
+        assert [item["quantity"] for item in data["items"]] == [15]
+        
+        past = client.get(
+            f"/api/stock/as-of?date={before}&product_id={product_id}",
+            headers=headers
+        ).json()
+        assert past["items"] == []
+
+
+class TestStockConcurrency:
+    """Stress tests for concurrent stock changes"""
+    
+    def test_parallel_transfers_never_overdraw(self):
+        """Test hundreds of parallel transfers never drive a balance negative"""
+        from concurrent.futures import ThreadPoolExecutor
+        from app.database import SessionLocal
+        from app.models import WarehouseStock
+        from app.services.stock_service import rebuild_product_stock_totals
+        
+        headers = get_auth_header()
+        
+        product_id = create_test_product(headers)
+        source_id = create_test_warehouse(headers)
+        target_id = create_test_warehouse(headers)
+        project_id = create_test_project(headers)
+        
+        client.post(
+            "/api/stock/movements",
+            json={
+                "project_id": project_id,
+                "product_id": product_id,
+                "movement_type": "IN",
+                "to_warehouse_id": source_id,
+                "quantity": 30
+            },
+            headers=headers
+        )
+        
+        def transfer(from_id, to_id):
+            return client.post(
+                "/api/stock/transfer",
+                json={
+                    "project_id": project_id,
+                    "product_id": product_id,
+                    "from_warehouse_id": from_id,
+                    "to_warehouse_id": to_id,
+                    "quantity": 1
+                },
+                headers=headers
+            ).status_code
+        
+        # 100 one-way transfers against 30 units: exactly 30 may succeed
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            codes = list(pool.map(lambda _: transfer(source_id, target_id), range(100)))
+        assert codes.count(200) == 30
+        assert codes.count(400) == 70
+        
+        # 200 transfers in both directions at once: stock is only moved, never lost
+        directions = [(source_id, target_id), (target_id, source_id)] * 100
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            codes = list(pool.map(lambda pair: transfer(*pair), directions))
+        assert set(codes) <= {200, 400}
+        
+        db = SessionLocal()
+        try:
+            quantities = [
+                float(stock.quantity)
+                for stock in db.query(WarehouseStock).filter(WarehouseStock.product_id == product_id)
+            ]
+            assert len(quantities) == 2
+            assert min(quantities) >= 0
+            assert sum(quantities) == 30
+            assert rebuild_product_stock_totals(db, [product_id], dry_run=True) == []
+        finally:
+            db.close()